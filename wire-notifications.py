@@ -6,103 +6,389 @@ Run from the root of the deepterm-web repo on the Pi:
     python3 wire-notifications.py
 """
 
+import mmap
 import os
+import stat
 import sys
 
+# Appended to every file once all of its patches went in; a later run that
+# finds it skips the file without looking at the individual patches.
+_STAMP = b'// wire-notifications:v1'
+
+# Output is collected here and written with a single write by _emit() rather
+# than flushing the (slow, line-buffered) terminal once per line.
+_LOG: list[str] = []
+
+
+def _emit():
+    if _LOG:
+        sys.stdout.write('\n'.join(_LOG) + '\n')
+        sys.stdout.flush()
+        _LOG.clear()
+
+
+class _Empty(bytes):
+    """Empty content that works as its own context manager, like an mmap."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _map(f):
+    """Read-only mmap of an open file (mmap cannot map an empty file)."""
+    if os.fstat(f.fileno()).st_size == 0:
+        return _Empty()
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _crlf(p):
+    """Patch p with its markers and inserted text using CRLF line endings."""
+    return Patch(
+        p.path,
+        p.kind,
+        p.marker.replace(b'\n', b'\r\n') if p.marker is not None else None,
+        p.payload.replace(b'\n', b'\r\n'),
+        p.sentinel,
+    )
+
+
+def _stamped(filepath):
+    """True if filepath already carries _STAMP; False if it cannot be read."""
+    try:
+        with open(filepath, 'rb') as f, _map(f) as mm:
+            return mm.find(_STAMP) != -1
+    except OSError:
+        return False  # apply_file() reports the error
+
+
+def _load(filepath, patches):
+    """Plan a batch of patches for one file.
+
+    Returns (content, edits, newline, status): content is None if no patch has
+    anything left to do. Contents are kept as raw bytes: nothing here needs
+    decoded text, so the UTF-8 decode and re-encode of every file is skipped.
+    Without text mode's newline translation, patches are converted to CRLF
+    instead when the file's first line ends in one. The planners run once,
+    against an mmap of the file; it is only copied onto the heap when there
+    is something to write, and the edits' offsets still hold for the copy.
+    """
+    with open(filepath, 'rb') as f, _map(f) as mm:
+        # The first line ending decides; a stray CRLF further down (a pasted
+        # snippet, say) must not switch a LF file over
+        eol = mm.find(b'\n')
+        newline = b'\r\n' if eol > 0 and mm[eol - 1] == 0x0d else b'\n'
+        if newline != b'\n':
+            patches = [_crlf(p) for p in patches]
+        if mm.find(_STAMP) != -1:
+            return None, [], newline, [f"  ~ Already applied in {filepath}" for p in patches if p.kind != 'import']
+        edits, status = _plan(filepath, mm, patches)
+        return (mm[:] if edits else None), edits, newline, status
+
+
+def _writev_all(fd, chunks):
+    """os.writev() that keeps going after a partial write."""
+    chunks = [memoryview(c) for c in chunks if len(c)]
+    while chunks:
+        written = os.writev(fd, chunks)
+        while written:
+            if written >= len(chunks[0]):
+                written -= len(chunks.pop(0))
+            else:
+                chunks[0] = chunks[0][written:]
+                written = 0
+
+
+def _write_atomic(filepath, chunks):
+    """Write chunks next to filepath and rename the result into place.
+
+    The chunks go out with one scatter-gather os.writev() where available, so
+    the patched file is never joined into a single buffer. An interrupted run
+    leaves either the old or the new file, never a truncated one.
+    """
+    tmp = filepath + '.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            if hasattr(os, 'writev'):
+                _writev_all(f.fileno(), chunks)
+            else:  # Windows
+                f.writelines(chunks)
+                f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, stat.S_IMODE(os.stat(filepath).st_mode))
+        os.replace(tmp, filepath)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _entries(path):
+    """Directory listing of path as {name: DirEntry}; empty if path is not a directory."""
+    try:
+        with os.scandir(path) as it:
+            return {e.name: e for e in it}
+    except (FileNotFoundError, NotADirectoryError):
+        return {}
+
+
 def check_prereqs():
-    if not os.path.exists("package.json") or not os.path.isdir("src/app/api"):
+    # One listing answers both package.json and src (DirEntry.is_dir() needs
+    # no extra stat()); src/app/api then takes a single stat() of its own
+    root = _entries(".")
+    src = root.get("src")
+    if "package.json" not in root or not (src and src.is_dir() and os.path.isdir("src/app/api")):
+        _emit()
         print("❌ Run this script from the root of the deepterm-web repo.")
         sys.exit(1)
-    if not os.path.exists("src/lib/node-red.ts"):
+    if "node-red.ts" not in _entries("src/lib"):
+        _emit()
         print("❌ src/lib/node-red.ts not found. Copy it first.")
         sys.exit(1)
-    print("✅ Prerequisites OK\n")
+    _LOG.append("✅ Prerequisites OK")
+
+
+# ── Patches ──────────────────────────────────────────
+# Each helper returns a Patch; nothing is read or written until apply_file()
+# runs the whole batch for one file. All byte fields are encoded up front to
+# match the file contents.
+
+class Patch:
+    __slots__ = ('path', 'kind', 'marker', 'payload', 'sentinel')
+
+    def __init__(self, path, kind, marker, payload, sentinel=None):
+        self.path = path
+        self.kind = kind  # 'import', 'before', 'after' or 'replace'
+        self.marker = marker  # text to locate (unused for imports)
+        self.payload = payload  # import line, inserted block or replacement text
+        self.sentinel = sentinel  # unique line of payload that marks a re-run
+
+
+def _first_sentinel(block):
+    """First non-empty, non-comment line of block, used as its sentinel."""
+    for l in block.strip().split('\n'):
+        s = l.strip()
+        if s and not s.startswith('//'):
+            return s
+    return None
+
+
+def _encode(text):
+    return text.encode() if text is not None else None
+
+
+def _show(data):
+    """Printable head of a bytes marker for warning messages."""
+    return data[:60].decode(errors='replace')
 
 
 def insert_import(filepath, import_line):
-    with open(filepath, 'r') as f:
-        content = f.read()
-    if import_line in content:
-        return
-    lines = content.split('\n')
-    last_import_idx = -1
-    for i, line in enumerate(lines):
-        if line.startswith('import '):
-            last_import_idx = i
-    if last_import_idx >= 0:
-        lines.insert(last_import_idx + 1, import_line)
-    else:
-        lines.insert(0, import_line)
-    with open(filepath, 'w') as f:
-        f.write('\n'.join(lines))
+    # No sentinel: _import_edit() spots an existing import while scanning
+    return Patch(filepath, 'import', None, (import_line + '\n').encode())
 
 
 def insert_after(filepath, marker, code_block):
-    with open(filepath, 'r') as f:
-        content = f.read()
-    # Check if already applied (use a unique line from the code block)
-    check_lines = [l.strip() for l in code_block.strip().split('\n') if l.strip() and not l.strip().startswith('//')]
-    if check_lines and check_lines[0] in content:
-        print(f"  ~ Already applied in {filepath}")
-        return
-    idx = content.find(marker)
-    if idx == -1:
-        print(f"  ⚠ Marker not found: {marker[:60]}")
-        return
-    end_of_line = content.index('\n', idx)
-    content = content[:end_of_line + 1] + code_block + content[end_of_line + 1:]
-    with open(filepath, 'w') as f:
-        f.write(content)
-    print(f"  ✅ Patched")
+    return Patch(filepath, 'after', marker.encode(), code_block.encode(), _encode(_first_sentinel(code_block)))
 
 
 def insert_before(filepath, marker, code_block):
-    with open(filepath, 'r') as f:
-        content = f.read()
-    check_lines = [l.strip() for l in code_block.strip().split('\n') if l.strip() and not l.strip().startswith('//')]
-    if check_lines and check_lines[0] in content:
-        print(f"  ~ Already applied in {filepath}")
-        return
-    idx = content.find(marker)
-    if idx == -1:
-        print(f"  ⚠ Marker not found: {marker[:60]}")
-        return
-    start_of_line = content.rfind('\n', 0, idx) + 1
-    content = content[:start_of_line] + code_block + content[start_of_line:]
-    with open(filepath, 'w') as f:
-        f.write(content)
-    print(f"  ✅ Patched")
+    return Patch(filepath, 'before', marker.encode(), code_block.encode(), _encode(_first_sentinel(code_block)))
 
 
 def replace_text(filepath, old_text, new_text):
-    with open(filepath, 'r') as f:
-        content = f.read()
-    if old_text not in content:
-        # Maybe already applied?
-        check_lines = [l.strip() for l in new_text.strip().split('\n') if l.strip() and not l.strip().startswith('//')]
-        if check_lines and check_lines[0] in content:
-            print(f"  ~ Already applied in {filepath}")
-            return
-        print(f"  ⚠ Text not found in {filepath}: {old_text[:60]}...")
-        return
-    content = content.replace(old_text, new_text, 1)
-    with open(filepath, 'w') as f:
-        f.write(content)
-    print(f"  ✅ Patched")
+    return Patch(filepath, 'replace', old_text.encode(), new_text.encode(), _encode(_first_sentinel(new_text)))
 
 
-def main():
-    print("═" * 55)
-    print("  Wiring Node-RED notifications into DeepTerm")
-    print("═" * 55 + "\n")
+def replace_texts(filepath, pairs):
+    """replace_text() for several (old_text, new_text) pairs in the same file."""
+    return [replace_text(filepath, old_text, new_text) for old_text, new_text in pairs]
+
+
+class _Hits(dict):
+    """First-occurrence offsets, each looked up with bytes.find() on first use."""
+    __slots__ = ('content',)
+
+    def __init__(self, content):
+        super().__init__()
+        self.content = content
+
+    def __missing__(self, needle):
+        idx = self[needle] = self.content.find(needle)
+        return idx
 
-    check_prereqs()
 
+def _import_edit(buf, line):
+    """Edit that adds line (an import plus its newline) after the last import line of buf.
+
+    Returns None if import_line is already one of those lines (ignoring
+    trailing whitespace such as a CR); the import block is walked once, so no
+    separate whole-file membership scan is needed.
+    """
+    import_line = line.rstrip()
+    insert_at = 0
+    i = -1  # offset of the newline preceding the current import line
+    if buf[:7] != b'import ':
+        i = buf.find(b'\nimport ')
+        if i == -1:
+            return (0, 0, line)
+    while True:
+        end = buf.find(b'\n', i + 1)
+        if end == -1:
+            if buf[i + 1:].rstrip() == import_line:
+                return None
+            # Last import is the final line and has no trailing newline
+            return (len(buf), len(buf), line[len(import_line):] + import_line)
+        if buf[i + 1:end].rstrip() == import_line:
+            return None
+        insert_at = end + 1
+        i = buf.find(b'\nimport ', end)
+        if i == -1:
+            return (insert_at, insert_at, line)
+
+
+def _plan_import(content, hits, p):
+    return _import_edit(content, p.payload)
+
+
+# Insertions leave their marker in place, so the sentinel only needs looking up
+# once the marker has been found.
+
+def _plan_after(content, hits, p):
+    idx = hits[p.marker]
+    if idx == -1:
+        return f"  ⚠ Marker not found: {_show(p.marker)}"
+    if p.sentinel and hits[p.sentinel] != -1:
+        return f"  ~ Already applied in {p.path}"
+    end_of_line = content.find(b'\n', idx)
+    insert_at = len(content) if end_of_line == -1 else end_of_line + 1
+    return (insert_at, insert_at, p.payload)
+
+
+def _plan_before(content, hits, p):
+    idx = hits[p.marker]
+    if idx == -1:
+        return f"  ⚠ Marker not found: {_show(p.marker)}"
+    if p.sentinel and hits[p.sentinel] != -1:
+        return f"  ~ Already applied in {p.path}"
+    start_of_line = content.rfind(b'\n', 0, idx) + 1
+    return (start_of_line, start_of_line, p.payload)
+
+
+def _plan_replace(content, hits, p):
+    idx = hits[p.marker]
+    # A replacement that keeps the old text still matches it after a run, so
+    # only the sentinel tells whether it was already applied
+    if idx == -1 or p.marker in p.payload:
+        if p.sentinel and hits[p.sentinel] != -1:
+            return f"  ~ Already applied in {p.path}"
+    if idx == -1:
+        return f"  ⚠ Text not found in {p.path}: {_show(p.marker)}..."
+    return (idx, idx + len(p.marker), p.payload)
+
+
+# A planner returns the edit (start, end, text) for its patch, None if there is
+# nothing to do, or a status line explaining why the patch was skipped.
+DISPATCH = {
+    'import': _plan_import,
+    'after': _plan_after,
+    'before': _plan_before,
+    'replace': _plan_replace,
+}
+
+
+def _plan(filepath, content, patches):
+    """Run the planners over content and return (edits, status).
+
+    Each needle is searched only when a planner asks for it, and at most once.
+    """
+    hits = _Hits(content)
+    edits = []
+    status = []
+    for p in patches:
+        edit = DISPATCH[p.kind](content, hits, p)
+        if edit is None:
+            continue
+        if isinstance(edit, str):
+            status.append(edit)
+            continue
+        if any(edit[0] < other[1] and other[0] < edit[1] for other in edits):
+            status.append(f"  ⚠ Overlapping patch skipped in {filepath}")
+            continue
+        edits.append(edit)
+        if p.kind != 'import':
+            status.append(f"  ✅ Patched")
+    return edits, status
+
+
+def apply_patches(filepath, patches):
+    """Plan a batch of patches for one file.
+
+    Returns (fragments, status): the new file content as a list of chunks, or
+    None if there is nothing to write, plus the status lines. The untouched
+    stretches are zero-copy views into the content, interleaved with the
+    inserted blocks.
+    """
+    content, edits, newline, status = _load(filepath, patches)
+    if content is None:
+        return None, status
+    # sort() is stable, so edits at the same offset keep their queue order
+    edits.sort(key=lambda e: e[0])
+    view = memoryview(content)
+    fragments = []
+    pos = 0
+    for start, end, text in edits:
+        fragments.append(view[pos:start])
+        fragments.append(text)
+        pos = end
+    fragments.append(view[pos:])
+    if not any("⚠" in line for line in status):
+        fragments.append(newline + _STAMP + newline)
+    return fragments, status
+
+
+def apply_file(filepath, patches):
+    """Patch one file end to end (one read, one write).
+
+    Returns (section, ok). I/O errors are reported in the section rather than
+    raised, so the sections of the other files, which may already have been
+    rewritten by then, are still printed.
+    """
+    try:
+        fragments, status = apply_patches(filepath, patches)
+        if fragments is not None:
+            _write_atomic(filepath, fragments)
+    except OSError as e:
+        return ["", SECTIONS[filepath], f"  ⚠ Could not patch {filepath}: {e.strerror or e}"], False
+    return ["", SECTIONS[filepath], *status], True
+
+
+# ── Patch table ──────────────────────────────────────
+APP_ISSUE_ROUTE = "src/app/api/app/issues/submit/route.ts"
+ISSUE_ROUTE = "src/app/api/issues/route.ts"
+IDEA_ROUTE = "src/app/api/ideas/route.ts"
+IDEA_VOTE_ROUTE = "src/app/api/ideas/[id]/vote/route.ts"
+STRIPE_WEBHOOK_ROUTE = "src/app/api/stripe/webhook/route.ts"
+RELEASE_UPLOAD_ROUTE = "src/app/api/admin/downloads/upload/route.ts"
+INTRUSION_LIB = "src/lib/intrusion.ts"
+
+SECTIONS = {
+    APP_ISSUE_ROUTE: "📝 [1/7] App issue submission → notifyNewIssue()",
+    ISSUE_ROUTE: "📝 [2/7] Website issue submission → notifyNewIssue()",
+    IDEA_ROUTE: "📝 [3/7] Idea submission → notifyNewIdea()",
+    IDEA_VOTE_ROUTE: "📝 [4/7] Idea vote threshold → notifyIdeaPopular()",
+    STRIPE_WEBHOOK_ROUTE: "📝 [5/7] Stripe webhook → notifyPayment()",
+    RELEASE_UPLOAD_ROUTE: "📝 [6/7] Release upload → notifyRelease()",
+    INTRUSION_LIB: "📝 [7/7] Security alerts → notifySecurityAlert()",
+}
+
+PATCHES = [
     # ── 1. App issue submission ──────────────────────────
-    print("📝 [1/7] App issue submission → notifyNewIssue()")
-    f = "src/app/api/app/issues/submit/route.ts"
-    insert_import(f, "import { notifyNewIssue } from '@/lib/node-red';")
-    insert_before(f,
+    insert_import(APP_ISSUE_ROUTE, "import { notifyNewIssue } from '@/lib/node-red';"),
+    insert_before(APP_ISSUE_ROUTE,
         "return NextResponse.json({\n      success: true,\n      message: 'Issue submitted successfully'",
         "\n    // Notify Node-RED → WhatsApp (fire-and-forget)\n"
         "    notifyNewIssue({\n"
@@ -113,13 +399,11 @@ def main():
         "      authorEmail: user.email,\n"
         "      source: 'app',\n"
         "    });\n\n"
-    )
+    ),
 
     # ── 2. Website issue submission ──────────────────────
-    print("\n📝 [2/7] Website issue submission → notifyNewIssue()")
-    f = "src/app/api/issues/route.ts"
-    insert_import(f, "import { notifyNewIssue } from '@/lib/node-red';")
-    insert_before(f,
+    insert_import(ISSUE_ROUTE, "import { notifyNewIssue } from '@/lib/node-red';"),
+    insert_before(ISSUE_ROUTE,
         "return NextResponse.json({ success: true, id: issue.id });",
         "\n  // Notify Node-RED → WhatsApp (fire-and-forget)\n"
         "  notifyNewIssue({\n"
@@ -130,13 +414,11 @@ def main():
         "    authorEmail: session.user?.email || '',\n"
         "    source: 'website',\n"
         "  });\n\n"
-    )
+    ),
 
     # ── 3. Idea submission ───────────────────────────────
-    print("\n📝 [3/7] Idea submission → notifyNewIdea()")
-    f = "src/app/api/ideas/route.ts"
-    insert_import(f, "import { notifyNewIdea } from '@/lib/node-red';")
-    insert_after(f,
+    insert_import(IDEA_ROUTE, "import { notifyNewIdea } from '@/lib/node-red';"),
+    insert_after(IDEA_ROUTE,
         "// Auto-vote for the author",
         "\n    // Notify Node-RED → WhatsApp (fire-and-forget)\n"
         "    notifyNewIdea({\n"
@@ -146,13 +428,11 @@ def main():
         "      category: 'feature',\n"
         "      authorEmail: session.user?.email || '',\n"
         "    });\n\n"
-    )
+    ),
 
     # ── 4. Idea vote → threshold ─────────────────────────
-    print("\n📝 [4/7] Idea vote threshold → notifyIdeaPopular()")
-    f = "src/app/api/ideas/[id]/vote/route.ts"
-    insert_import(f, "import { notifyIdeaPopular } from '@/lib/node-red';")
-    replace_text(f,
+    insert_import(IDEA_VOTE_ROUTE, "import { notifyIdeaPopular } from '@/lib/node-red';"),
+    replace_text(IDEA_VOTE_ROUTE,
         "return NextResponse.json({ \n        voted: true, \n        votes: voteCount \n      });",
         "// Check vote threshold → WhatsApp notification\n"
         "      const VOTE_THRESHOLD = 5;\n"
@@ -165,44 +445,42 @@ def main():
         "        });\n"
         "      }\n\n"
         "      return NextResponse.json({ \n        voted: true, \n        votes: voteCount \n      });"
-    )
+    ),
 
     # ── 5. Stripe webhook ────────────────────────────────
-    print("\n📝 [5/7] Stripe webhook → notifyPayment()")
-    f = "src/app/api/stripe/webhook/route.ts"
-    insert_import(f, "import { notifyPayment } from '@/lib/node-red';")
-    replace_text(f,
-        "      cancelAtPeriodEnd: subscription.cancel_at_period_end,\n    },\n  });\n}",
-        "      cancelAtPeriodEnd: subscription.cancel_at_period_end,\n"
-        "    },\n"
-        "  });\n"
-        "\n"
-        "  // Notify Node-RED → WhatsApp\n"
-        "  notifyPayment({\n"
-        "    event: 'subscription-created',\n"
-        "    email: session.customer_email || '',\n"
-        "    plan: await getPlanFromPriceId(subscription.items.data[0].price.id),\n"
-        "    amount: subscription.items.data[0].price.unit_amount || 0,\n"
-        "  });\n"
-        "}"
-    )
-    replace_text(f,
-        "// TODO: Send email notification about failed payment",
-        "// Notify Node-RED → WhatsApp\n"
-        "  notifyPayment({\n"
-        "    event: 'payment-failed',\n"
-        "    email: (invoice as any).customer_email || '',\n"
-        "    plan: team.plan || 'unknown',\n"
-        "    amount: invoice.amount_due,\n"
-        "    details: 'Invoice payment failed',\n"
-        "  });"
-    )
+    insert_import(STRIPE_WEBHOOK_ROUTE, "import { notifyPayment } from '@/lib/node-red';"),
+    *replace_texts(STRIPE_WEBHOOK_ROUTE, [
+        (
+            "      cancelAtPeriodEnd: subscription.cancel_at_period_end,\n    },\n  });\n}",
+            "      cancelAtPeriodEnd: subscription.cancel_at_period_end,\n"
+            "    },\n"
+            "  });\n"
+            "\n"
+            "  // Notify Node-RED → WhatsApp\n"
+            "  notifyPayment({\n"
+            "    event: 'subscription-created',\n"
+            "    email: session.customer_email || '',\n"
+            "    plan: await getPlanFromPriceId(subscription.items.data[0].price.id),\n"
+            "    amount: subscription.items.data[0].price.unit_amount || 0,\n"
+            "  });\n"
+            "}"
+        ),
+        (
+            "// TODO: Send email notification about failed payment",
+            "// Notify Node-RED → WhatsApp\n"
+            "  notifyPayment({\n"
+            "    event: 'payment-failed',\n"
+            "    email: (invoice as any).customer_email || '',\n"
+            "    plan: team.plan || 'unknown',\n"
+            "    amount: invoice.amount_due,\n"
+            "    details: 'Invoice payment failed',\n"
+            "  });"
+        ),
+    ]),
 
     # ── 6. Release upload ────────────────────────────────
-    print("\n📝 [6/7] Release upload → notifyRelease()")
-    f = "src/app/api/admin/downloads/upload/route.ts"
-    insert_import(f, "import { notifyRelease } from '@/lib/node-red';")
-    insert_before(f,
+    insert_import(RELEASE_UPLOAD_ROUTE, "import { notifyRelease } from '@/lib/node-red';"),
+    insert_before(RELEASE_UPLOAD_ROUTE,
         "return NextResponse.json({\n      success: true,\n      message: 'Release uploaded successfully.'",
         "\n    // Notify Node-RED → WhatsApp\n"
         "    notifyRelease({\n"
@@ -210,13 +488,11 @@ def main():
         "      platform,\n"
         "      releaseNotes: releaseNotes || undefined,\n"
         "    });\n\n"
-    )
+    ),
 
     # ── 7. Security alerts ───────────────────────────────
-    print("\n📝 [7/7] Security alerts → notifySecurityAlert()")
-    f = "src/lib/intrusion.ts"
-    insert_import(f, "import { notifySecurityAlert } from '@/lib/node-red';")
-    insert_after(f,
+    insert_import(INTRUSION_LIB, "import { notifySecurityAlert } from '@/lib/node-red';"),
+    insert_after(INTRUSION_LIB,
         ".catch(err => console.error('[Intrusion] Email send failed:', err));",
         "\n      // Also notify via WhatsApp (fire-and-forget)\n"
         "      notifySecurityAlert({\n"
@@ -225,17 +501,57 @@ def main():
         "        sourceIp: event.ip,\n"
         "        details: `${count} events in ${WINDOW_MS / 60000}min – path: ${event.path || '-'}`,\n"
         "      }).catch(() => {});\n"
-    )
+    ),
+]
+
+
+def main():
+    _LOG.append("═" * 55)
+    _LOG.append("  Wiring Node-RED notifications into DeepTerm")
+    _LOG.append("═" * 55 + "\n")
+
+    try:
+        check_prereqs()
+
+        by_path = {}
+        for p in PATCHES:
+            by_path.setdefault(p.path, []).append(p)
+
+        # Each group owns a distinct file, so they can patch concurrently;
+        # map() hands the sections back in table order. On a re-run every
+        # file carries the stamp and _load() returns at once, so the thread
+        # pool (and the import of concurrent.futures) is only set up when
+        # some file still has patching to do.
+        if all(_stamped(path) for path in by_path):
+            results = map(apply_file, by_path.keys(), by_path.values())
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=4) as ex:
+                results = list(ex.map(apply_file, by_path.keys(), by_path.values()))
+        failed = 0
+        for section, ok in results:
+            _LOG.extend(section)
+            failed += not ok
+
+        if failed:
+            _LOG.append("\n" + "═" * 55)
+            _LOG.append(f"  ❌ {failed} file(s) could not be patched; the others were.")
+            _LOG.append("  Review:   git diff")
+            _LOG.append("═" * 55)
+            _emit()
+            sys.exit(1)
 
-    print("\n" + "═" * 55)
-    print("  ✅ All 7 files patched!")
-    print()
-    print("  Next steps:")
-    print("  1. Review:   git diff")
-    print("  2. Build:    npm run build")
-    print("  3. Restart:  pm2 restart deepterm")
-    print("  4. Test:     Submit an issue from the app or website")
-    print("═" * 55)
+        _LOG.append("\n" + "═" * 55)
+        _LOG.append("  ✅ All 7 files patched!")
+        _LOG.append("")
+        _LOG.append("  Next steps:")
+        _LOG.append("  1. Review:   git diff")
+        _LOG.append("  2. Build:    npm run build")
+        _LOG.append("  3. Restart:  pm2 restart deepterm")
+        _LOG.append("  4. Test:     Submit an issue from the app or website")
+        _LOG.append("═" * 55)
+    finally:
+        _emit()
 
 
 if __name__ == "__main__":